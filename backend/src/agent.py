@@ -1,14 +1,12 @@
 # agent.py (fixed)
 import logging
-import json
 import random
 import os
 import sys
 import asyncio
-from typing import Dict, Any, List, Optional
-from pathlib import Path
-from datetime import datetime
-import uuid
+from dataclasses import dataclass, field, asdict
+from enum import IntEnum
+from typing import Dict, Any, List, Optional, Tuple
 import time
 
 from dotenv import load_dotenv
@@ -28,35 +26,48 @@ from livekit.agents import (
 )
 from livekit.plugins import murf, silero, google, deepgram, noise_cancellation
 from livekit.plugins.turn_detector.multilingual import MultilingualModel
+import orjson
+
+
+def _loop_running() -> bool:
+    """True when imported from inside a running event loop (tests, notebooks)."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
 
 # Windows-specific imports and fixes
 if os.name == "nt":
     import signal
     if not hasattr(signal, "SIGKILL"):
         signal.SIGKILL = signal.SIGTERM
-    # Set event loop policy for Windows
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-
-logger = logging.getLogger("improv-battle-agent")
-
-# Load environment variables
-env_path = Path(".env.local")
-if env_path.exists():
-    load_dotenv(env_path)
+    # libuv-backed event loop for Windows
+    import winloop
+    _loop_policy = winloop.EventLoopPolicy()
 else:
-    load_dotenv()  # Fallback to default .env
+    import uvloop
+    _loop_policy = uvloop.EventLoopPolicy()
 
-class ImprovBattleAgent(Agent):
-    """
-    Single–player Improv Battle host.
+# Swapping the policy under a running loop would orphan its pending tasks.
+if not _loop_running():
+    asyncio.set_event_loop_policy(_loop_policy)
 
-    State is stored per Agent instance in self.improv_state.
-    The LLM manipulates state via the tools below.
-    """
+logger = logging.getLogger("improv-battle-agent")
 
-    def __init__(self) -> None:
-        super().__init__(
-            instructions="""
+# Load environment variables once; worker processes inherit them along with the flag.
+if not os.environ.get("_IMPROV_ENV_LOADED"):
+    if os.path.isfile(".env.local"):
+        load_dotenv(".env.local")
+    else:
+        load_dotenv()  # Fallback to default .env
+    os.environ["_IMPROV_ENV_LOADED"] = "1"
+
+# System prompt for the host. Built once at import and shared by every session;
+# it never changes mid-session so the LLM's prefix cache keeps hitting. Per-session
+# state reaches the model only through tool replies.
+_STATIC_RULES: str = """
 You are the high-energy host of a TV improv show called **"Improv Battle"**.
 
 GENERAL VIBE
@@ -129,6 +140,7 @@ YOUR FLOW
 
 3) CLOSING SUMMARY
 - When the game reaches max_rounds OR the phase becomes "done":
+    - Call get_game_state to review the stored rounds.
     - Give a short summary of the player's *overall improv style* based on the stored rounds:
         - Are they more character-focused, absurd, story-driven, emotional, deadpan, etc.?
     - Mention at least one specific moment or scene detail that stood out.
@@ -165,83 +177,191 @@ REMINDERS
 - Do NOT expose tool names directly to the user; just talk like a normal host.
 - Stay in character as the Improv Battle host at all times.
 """
-        )
 
+# A small pool of scenario templates; start_new_round samples from them.
+# Keep exactly 8 entries so random.getrandbits(3) indexes it uniformly.
+_BASE_SCENARIOS: Tuple[str, ...] = (
+    "You are a time-travelling tour guide trying to explain modern smartphones to someone from the 1800s.",
+    "You are a restaurant waiter who must calmly tell a customer that their order has escaped the kitchen.",
+    "You are a customer trying to return an obviously cursed object to a very skeptical shop owner.",
+    "You are a barista who has to tell a customer that their latte is actually a portal to another dimension.",
+    "You are a superhero whose only power is giving unbelievably specific but useless life advice.",
+    "You are a tech support agent explaining to a medieval knight why they cannot swing their sword at the Wi-Fi router.",
+    "You are a weather reporter who can secretly control the weather but must pretend everything is normal.",
+    "You are a museum night guard who has to convince the exhibits to return to their displays before opening time.",
+)
+assert len(_BASE_SCENARIOS) == 8, "start_new_round indexes _BASE_SCENARIOS with getrandbits(3)"
+
+# Outros spoken directly when the client ends the game over RPC (no LLM turn).
+_OUTROS: Tuple[str, ...] = (
+    "And that's a wrap on tonight's Improv Battle! Thanks for playing, come back any time for another round.",
+    "Curtain down! Thanks for bringing the energy to Improv Battle. The stage is yours whenever you want a rematch.",
+    "That's the show, folks! Thanks for jumping in with me on Improv Battle. See you next time!",
+)
+
+
+class Tone(IntEnum):
+    """Host reaction tone recorded for each round."""
+
+    SUPPORTIVE = 0
+    MIXED = 1
+    CRITICAL = 2
+
+
+# Normalized tone string -> Tone; unknown tones fall back to MIXED at the call site.
+_TONE_MAP = {"supportive": Tone.SUPPORTIVE, "mixed": Tone.MIXED, "critical": Tone.CRITICAL}.get
+
+
+_MAX_PLAYER_NAME_LEN = 40
+
+
+# dataclass(slots=True) needs Python 3.10+; fall back to a regular dataclass on 3.9.
+_SLOTS: Dict[str, bool] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
+class RoundRecord:
+    """A completed round as stored in ImprovState.rounds."""
+
+    round_number: int
+    scenario: str
+    reaction_summary: str
+    tone: Tone
+
+
+@dataclass(**_SLOTS)
+class ImprovState:
+    """Per-session game state manipulated by the host's tools."""
+
+    player_name: Optional[str] = None
+    current_round: int = 0
+    max_rounds: int = 3
+    # One slot per round, preallocated to max_rounds and filled as rounds complete
+    rounds: List[Optional[RoundRecord]] = field(default_factory=list)
+    phase: str = "intro"  # "intro" | "awaiting_improv" | "reacting" | "done"
+    current_scenario: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if not self.rounds:
+            self.rounds = [None] * self.max_rounds
+
+
+def _clean_player_name(raw: str) -> str:
+    """Blank out control characters, collapse whitespace and cap the length of a user-supplied name."""
+    printable = "".join(ch if ch.isprintable() else " " for ch in raw)
+    return " ".join(printable.split())[:_MAX_PLAYER_NAME_LEN]
+
+
+def _dumps(obj: Any) -> str:
+    """Serialize obj to a JSON string with orjson.
+
+    Tools return these strings directly so the framework never re-serializes
+    their output with the stdlib encoder.
+    """
+    return orjson.dumps(obj).decode()
+
+
+class ImprovBattleAgent(Agent):
+    """
+    Single–player Improv Battle host.
+
+    State is stored per Agent instance in self.improv_state.
+    The LLM manipulates state via the tools below.
+    """
+
+    # Shared, never-mutated replies for start_new_round once the game is over.
+    _FINISHED_DONE: str = _dumps({"status": "finished", "message": "Game is already finished."})
+    _FINISHED_CAP: str = _dumps({"status": "finished", "message": "Reached maximum rounds."})
+
+    def __init__(self) -> None:
         # Simple state per session
-        self.improv_state: Dict[str, Any] = {
-            "player_name": None,
-            "current_round": 0,
-            "max_rounds": 3,
-            "rounds": [],  # list[{"round_number", "scenario", "reaction_summary", "tone"}]
-            "phase": "intro",  # "intro" | "awaiting_improv" | "reacting" | "done"
-            "current_scenario": None,
-        }
+        improv_state = ImprovState()
+
+        super().__init__(instructions=_STATIC_RULES)
+        self.improv_state = improv_state
+        # Serialized view of improv_state; every mutation must reset it to None.
+        self._state_json_cache: Optional[str] = None
+
+    def _state_json(self) -> str:
+        """Return the cached JSON view of the state, rebuilding it if stale."""
+        if self._state_json_cache is None:
+            view = asdict(self.improv_state)
+            # Emit tones by name so the model sees "supportive" rather than 0.
+            view["rounds"] = [
+                {**r, "tone": r["tone"].name.lower()} for r in view["rounds"] if r is not None
+            ]
+            self._state_json_cache = _dumps(view)
+        return self._state_json_cache
+
+    # Mutating tools return only what changed; get_game_state is the one full view.
+
+    def _delta_for_start(self, scenario: str) -> str:
+        return _dumps({
+            "status": "ok",
+            "scenario": scenario,
+            "round_number": self.improv_state.current_round,
+            "phase": "awaiting_improv",
+        })
+
+    def _delta_for_complete(self) -> str:
+        state = self.improv_state
+        return _dumps({
+            "status": "ok",
+            "current_round": state.current_round,
+            "phase": state.phase,
+            "is_last": state.current_round >= state.max_rounds,
+        })
 
     # --------- TOOLS EXPOSING BACKEND STATE ---------
+    # Tool bodies never await, so each one runs atomically on the event loop and
+    # parallel tool calls need no locking. Push any future blocking I/O through
+    # asyncio.to_thread after the state update rather than holding state across it.
 
     @function_tool
-    async def get_game_state(self, context: RunContext) -> Dict[str, Any]:
+    async def get_game_state(self, context: RunContext) -> str:
         """Get the current improv game state (read-only for the model)."""
-        return self.improv_state
+        # hot path: no await
+        return self._state_json()
 
     @function_tool
-    async def set_player_name(self, context: RunContext, player_name: str) -> Dict[str, Any]:
+    async def set_player_name(self, context: RunContext, player_name: str) -> str:
         """Set or update the player's display name."""
-        self.improv_state["player_name"] = player_name.strip() or "Player"
-        return self.improv_state
+        self.improv_state.player_name = _clean_player_name(player_name) or "Player"
+        self._state_json_cache = None
+        return _dumps({"status": "ok", "player_name": self.improv_state.player_name})
 
     @function_tool
-    async def start_new_round(self, context: RunContext) -> Dict[str, Any]:
+    async def start_new_round(self, context: RunContext) -> str:
         """
         Start the next improv round.
 
         Increments the round counter, sets phase to 'awaiting_improv', and
         generates a scenario string for this round.
         """
-        if self.improv_state["phase"] == "done":
-            return {
-                "status": "finished",
-                "message": "Game is already finished.",
-                "state": self.improv_state,
-            }
+        state = self.improv_state
+        if state.phase == "done":
+            return self._FINISHED_DONE
 
         # If already at or beyond max rounds, mark done
-        if self.improv_state["current_round"] >= self.improv_state["max_rounds"]:
-            self.improv_state["phase"] = "done"
-            return {
-                "status": "finished",
-                "message": "Reached maximum rounds.",
-                "state": self.improv_state,
-            }
-
-        self.improv_state["current_round"] += 1
-        self.improv_state["phase"] = "awaiting_improv"
-
-        round_no = self.improv_state["current_round"]
-        name = self.improv_state["player_name"] or "Player"
-
-        # A small pool of scenario templates; we will sample from them.
-        base_scenarios = [
-            "You are a time-travelling tour guide trying to explain modern smartphones to someone from the 1800s.",
-            "You are a restaurant waiter who must calmly tell a customer that their order has escaped the kitchen.",
-            "You are a customer trying to return an obviously cursed object to a very skeptical shop owner.",
-            "You are a barista who has to tell a customer that their latte is actually a portal to another dimension.",
-            "You are a superhero whose only power is giving unbelievably specific but useless life advice.",
-            "You are a tech support agent explaining to a medieval knight why they cannot swing their sword at the Wi-Fi router.",
-            "You are a weather reporter who can secretly control the weather but must pretend everything is normal.",
-        ]
-
-        scenario = random.choice(base_scenarios)
+        if state.current_round >= state.max_rounds:
+            state.phase = "done"
+            self._state_json_cache = None
+            return self._FINISHED_CAP
+
+        state.current_round += 1
+        state.phase = "awaiting_improv"
+
+        round_no = state.current_round
+        name = state.player_name or "Player"
+
+        scenario = _BASE_SCENARIOS[random.getrandbits(3)]
         # Add player name and round context to help the host phrase it nicely.
-        decorated_scenario = f"Round {round_no} for {name}: {scenario}"
+        decorated_scenario = "Round " + str(round_no) + " for " + name + ": " + scenario
 
-        self.improv_state["current_scenario"] = decorated_scenario
+        state.current_scenario = decorated_scenario
+        self._state_json_cache = None
 
-        return {
-            "status": "ok",
-            "scenario": decorated_scenario,
-            "state": self.improv_state,
-        }
+        return self._delta_for_start(decorated_scenario)
 
     @function_tool
     async def complete_round(
@@ -249,7 +369,7 @@ REMINDERS
         context: RunContext,
         reaction_summary: str,
         tone: str,
-    ) -> Dict[str, Any]:
+    ) -> str:
         """
         Mark the current round as completed and store host reaction info.
 
@@ -257,54 +377,67 @@ REMINDERS
         - reaction_summary: 1–2 sentence text summary of how the scene went.
         - tone: one of "supportive", "mixed", or "critical".
         """
-        current_round = self.improv_state["current_round"]
-        scenario = self.improv_state.get("current_scenario")
+        current_round = self.improv_state.current_round
+        scenario = self.improv_state.current_scenario
 
         if not scenario or current_round == 0:
-            return {
+            return _dumps({
                 "status": "error",
                 "message": "No active round to complete.",
-                "state": self.improv_state,
-            }
-
-        self.improv_state["rounds"].append(
-            {
-                "round_number": current_round,
-                "scenario": scenario,
-                "reaction_summary": reaction_summary.strip(),
-                "tone": tone.strip().lower(),
-            }
+                "phase": self.improv_state.phase,
+            })
+
+        tone_value = _TONE_MAP(tone.strip().lower(), Tone.MIXED)
+        self.improv_state.rounds[current_round - 1] = RoundRecord(
+            current_round, scenario, reaction_summary.strip(), tone_value
         )
 
         # After reaction, either we will start a new round or finish the game.
         # Phase will be updated by start_new_round or end_game.
-        self.improv_state["phase"] = "reacting"
-        self.improv_state["current_scenario"] = None
+        self.improv_state.phase = "reacting"
+        self.improv_state.current_scenario = None
 
         # If this was the last round, we mark as done here so the host knows to summarize.
-        if current_round >= self.improv_state["max_rounds"]:
-            self.improv_state["phase"] = "done"
+        if current_round >= self.improv_state.max_rounds:
+            self.improv_state.phase = "done"
+        self._state_json_cache = None
 
-        return {
-            "status": "ok",
-            "state": self.improv_state,
-        }
+        return self._delta_for_complete()
 
     @function_tool
-    async def end_game(self, context: RunContext, reason: str = "user_requested_stop") -> Dict[str, Any]:
+    async def end_game(self, context: RunContext, reason: str = "user_requested_stop") -> str:
         """
         End the game early, e.g. when the user asks to stop.
         """
-        self.improv_state["phase"] = "done"
-        return {
-            "status": "ended",
-            "reason": reason,
-            "state": self.improv_state,
-        }
+        return self._end_game(reason)
+
+    def end_game_from_client(self, reason: str = "client_requested_stop") -> str:
+        """End the game for a client RPC; the caller speaks the outro itself."""
+        return self._end_game(reason)
+
+    def _end_game(self, reason: str) -> str:
+        self.improv_state.phase = "done"
+        self._state_json_cache = None
+        return _dumps({"status": "ended", "reason": reason})
+
+
+def _build_stt() -> deepgram.STT:
+    return deepgram.STT(model="nova-3")
+
+
+def _build_tts() -> murf.TTS:
+    return murf.TTS(
+        voice="en-US-matthew",
+        style="Conversation",
+        # min_sentence_len is in characters: short interjections like "Nice!"
+        # are merged into the next sentence instead of sent as their own request.
+        tokenizer=tokenize.basic.SentenceTokenizer(min_sentence_len=20),
+        text_pacing=True,
+    )
 
 
 def prewarm(proc: JobProcess):
-    """Pre-warm the VAD model."""
+    """Pre-warm the VAD model and the LLM/STT/TTS clients used by the session."""
     try:
         proc.userdata["vad"] = silero.VAD.load()
         logger.info("VAD model pre-warmed successfully")
@@ -312,6 +445,25 @@ def prewarm(proc: JobProcess):
         logger.error(f"Error in prewarm: {e}")
         # Don't raise, continue without VAD if necessary
 
+    # The turn detector is built in the entrypoint: MultilingualModel() needs the
+    # job context, which doesn't exist yet during prewarm.
+    try:
+        proc.userdata["llm"] = google.LLM(model="gemini-2.5-flash")
+        logger.info("LLM pre-warmed successfully")
+    except Exception as e:
+        logger.error(f"Error in prewarm: {e}")
+        # Don't raise, entrypoint builds them per session instead
+
+    try:
+        # Job processes are single-use, so this only moves plugin construction
+        # off the room-join path; connections still open during session.start().
+        proc.userdata["stt"] = _build_stt()
+        proc.userdata["tts"] = _build_tts()
+        logger.info("STT and TTS clients pre-warmed successfully")
+    except Exception as e:
+        logger.error(f"Error in prewarm: {e}")
+        # Don't raise, entrypoint builds them per session instead
+
 
 # --- DEBUG PATCH START ---
 # Add a tiny helper to log and flush immediately:
@@ -388,16 +540,16 @@ async def entrypoint(ctx: JobContext):
                 loud(f"VAD load failed: {e} (continuing without VAD)")
                 vad_instance = None
 
+        turn_det = MultilingualModel()
+        llm_instance = ctx.proc.userdata.get("llm") or google.LLM(model="gemini-2.5-flash")
+        stt_instance = ctx.proc.userdata.get("stt") or _build_stt()
+        tts_instance = ctx.proc.userdata.get("tts") or _build_tts()
+
         session = AgentSession(
-            stt=deepgram.STT(model="nova-3"),
-            llm=google.LLM(model="gemini-2.5-flash"),
-            tts=murf.TTS(
-                voice="en-US-matthew",
-                style="Conversation",
-                tokenizer=tokenize.basic.SentenceTokenizer(min_sentence_len=2),
-                text_pacing=True,
-            ),
-            turn_detection=MultilingualModel(),
+            stt=stt_instance,
+            llm=llm_instance,
+            tts=tts_instance,
+            turn_detection=turn_det,
             vad=vad_instance,
             preemptive_generation=False,
         )
@@ -450,6 +602,20 @@ async def entrypoint(ctx: JobContext):
         start_ts = time.time()
         await session.start(agent=agent, room=ctx.room, room_input_options=RoomInputOptions(noise_cancellation=noise_cancellation.BVC()))
         loud(f"session.start() returned in {time.time() - start_ts:.2f}s -- session should be active")
+
+        # Fast path for UI commands like "stop game": skip the LLM and speak a canned outro.
+        async def _rpc_end_game(data) -> str:
+            loud(f"RPC improv.end_game from {data.caller_identity}")
+            try:
+                session.interrupt()
+            except RuntimeError:
+                # Non-interruptible speech: the outro is queued behind it instead.
+                loud("Current speech can't be interrupted; outro will follow it")
+            reply = agent.end_game_from_client()
+            session.say(random.choice(_OUTROS))
+            return reply
+
+        ctx.room.local_participant.register_rpc_method("improv.end_game", _rpc_end_game)
     except Exception as e:
         logger.exception("session.start or setup failed")
         loud(f"session.start/setup exception: {e}")
@@ -458,7 +624,7 @@ async def entrypoint(ctx: JobContext):
     # heartbeat so you see process alive and waiting for participants
     async def heartbeat():
         while True:
-            loud(f"HEARTBEAT: agent alive, rounds={agent.improv_state.get('current_round')}, phase={agent.improv_state.get('phase')}")
+            loud(f"HEARTBEAT: agent alive, rounds={agent.improv_state.current_round}, phase={agent.improv_state.phase}")
             await asyncio.sleep(10)
 
     # spawn heartbeat but don't block (fire-and-forget)